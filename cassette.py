@@ -0,0 +1,155 @@
+import os
+import json
+import base64
+import sqlite3
+import hashlib
+import threading
+import zlib
+from pathlib import Path
+from metrics import count
+
+RECORD = "record"
+REPLAY = "replay"
+
+class CassetteMiss(KeyError):
+    pass
+
+# -------------- Cassette Store --------------
+class Cassette:
+    def __init__(self, path, mode):
+        if mode not in (RECORD, REPLAY):
+            raise ValueError(f"Unknown cassette mode: {mode}")
+        self.path = path
+        self.mode = mode
+        self._lock = threading.Lock()
+        if mode == REPLAY:
+            # sqlite would silently create an empty database for a mistyped path
+            if not os.path.isfile(path):
+                raise FileNotFoundError(f"Cassette not found: {path}")
+            self._db = sqlite3.connect(f"{Path(path).resolve().as_uri()}?mode=ro", uri=True, check_same_thread=False)
+        else:
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute("CREATE TABLE IF NOT EXISTS entries (kind TEXT, key TEXT, value BLOB, PRIMARY KEY (kind, key))")
+            self._db.commit()
+
+    @staticmethod
+    def _key(parts):
+        return hashlib.sha256(json.dumps(parts, sort_keys=True, default=str).encode()).hexdigest()
+
+    def get(self, kind, parts):
+        with self._lock:
+            row = self._db.execute(
+                "SELECT value FROM entries WHERE kind = ? AND key = ?", (kind, self._key(parts))
+            ).fetchone()
+        if row is None:
+            raise CassetteMiss(f"No recorded {kind} response for {json.dumps(parts, default=str)[:200]}")
+        return json.loads(zlib.decompress(row[0]))
+
+    def put(self, kind, parts, value):
+        # Plain JSON only, so opening a cassette from elsewhere can't execute code
+        blob = zlib.compress(json.dumps(value, ensure_ascii=False).encode("utf-8"), 6)
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO entries (kind, key, value) VALUES (?, ?, ?)", (kind, self._key(parts), blob)
+            )
+            self._db.commit()
+
+    def call(self, kind, parts, func):
+        if self.mode == REPLAY:
+            count("cassette_replays")
+            return self.get(kind, parts)
+        value = func()
+        self.put(kind, parts, value)
+        count("cassette_records")
+        return value
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+CASSETTE = None  # active cassette, set by use_cassette()
+
+def use_cassette(path, mode):
+    global CASSETTE
+    CASSETTE = Cassette(path, mode) if path else None
+    return CASSETTE
+
+def through(kind, parts, func):
+    if CASSETTE is None:
+        return func()
+    return CASSETTE.call(kind, parts, func)
+
+def replaying():
+    return CASSETTE is not None and CASSETTE.mode == REPLAY
+
+# -------------- Gmail --------------
+class _Call:
+    def __init__(self, kind, parts, request_factory):
+        self._kind = kind
+        self._parts = parts
+        self._request_factory = request_factory
+
+    def execute(self):
+        return through(self._kind, self._parts, lambda: self._request_factory().execute())
+
+class CassetteGmailService:
+    # Mirrors the service.users().messages()... call chain used in main.py
+    def __init__(self, service=None):
+        self._service = service
+
+    def users(self):
+        return self
+
+    def messages(self):
+        return self
+
+    def attachments(self):
+        return _CassetteAttachments(self._service)
+
+    def list(self, userId, q, pageToken=None):
+        return _Call("gmail", ["list", userId, q, pageToken],
+                     lambda: self._service.users().messages().list(userId=userId, q=q, pageToken=pageToken))
+
+    def get(self, userId, id, format=None):
+        return _Call("gmail", ["get", userId, id, format],
+                     lambda: self._service.users().messages().get(userId=userId, id=id, format=format))
+
+class _CassetteAttachments:
+    def __init__(self, service):
+        self._service = service
+
+    def get(self, userId, messageId, id):
+        return _Call("gmail", ["attachment", userId, messageId, id],
+                     lambda: self._service.users().messages().attachments().get(userId=userId, messageId=messageId, id=id))
+
+def gmail_service(authenticate):
+    if CASSETTE is None:
+        return authenticate()
+    if CASSETTE.mode == REPLAY:
+        return CassetteGmailService()
+    return CassetteGmailService(authenticate())
+
+# -------------- HTTP --------------
+class RecordedResponse:
+    def __init__(self, status_code, headers, content):
+        self.status_code = status_code
+        self.headers = {key.lower(): value for key, value in headers.items()}
+        self.content = content
+
+def http_get(url, **kwargs):
+    def fetch():
+        import requests
+        try:
+            response = requests.get(url, **kwargs)
+        except Exception as e:
+            return {"error": str(e)}
+        return {"status_code": response.status_code, "headers": dict(response.headers),
+                "content": base64.b64encode(response.content).decode("ascii")}
+
+    if CASSETTE is None:
+        import requests
+        return requests.get(url, **kwargs)
+    result = CASSETTE.call("http", ["GET", url, "cookies" in kwargs], fetch)
+    if "error" in result:
+        raise ConnectionError(result["error"])
+    return RecordedResponse(result["status_code"], result["headers"], base64.b64decode(result["content"]))
@@ -0,0 +1,207 @@
+import os
+import json
+import socketserver
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+import fitz
+import main as sorter
+from invoice_extraction import extract_invoice_fields
+from file_placement import write_new_file
+from metrics import METRICS, timed
+from cassette import gmail_service
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+
+# -------------- Warm State --------------
+def warm_up():
+    # main.py imports its dependencies lazily; the daemon pays for all of them once at startup
+    import bs4, ollama, requests  # noqa: F401
+    if sorter.USE_OPENAI_KEY:
+        import openai  # noqa: F401
+    import generate_reisekosten_excel  # noqa: F401
+
+class DaemonState:
+    def __init__(self, calendar_context=None, rename_by_date=False):
+        self.calendar_context = calendar_context or {}
+        self.rename_by_date = rename_by_date
+        self._service = None
+        self.gmail_error = "Gmail was not connected at startup"
+        # The Gmail client (httplib2) is not thread-safe, so message requests are serialized
+        self._gmail_lock = threading.Lock()
+
+    def connect_gmail(self):
+        # Runs once before serving, so the OAuth browser flow never happens inside a request
+        try:
+            self._service = gmail_service(sorter.gmail_authenticate)
+        except Exception as e:
+            self.gmail_error = f"Gmail authentication failed at startup: {e}"
+            print(f"[!] {self.gmail_error}. /messages is disabled; /classify still works.")
+            return False
+        print("[✓] Gmail session authenticated")
+        return True
+
+    @property
+    def gmail_ready(self):
+        return self._service is not None
+
+    @timed("daemon_classify")
+    def classify_pdf(self, data=None, path=None, filename="upload.pdf", sort=False, llm_fields=False):
+        if path:
+            text = sorter.extract_text_from_pdf(path)
+        else:
+            try:
+                doc = fitz.open(stream=data, filetype="pdf")
+            except Exception as e:
+                raise ValueError(f"Request body is not a readable PDF: {e}")
+            with doc:
+                text = "\n".join(page.get_text() for page in doc)
+
+        category = sorter.categorize_invoice(text)
+        result = {"category": category if category in sorter.CATEGORIES else "Other"}
+        result.update(extract_invoice_fields(text))
+        if llm_fields:
+            from generate_reisekosten_excel import generate_llm_fields
+            result["fields"] = generate_llm_fields(text, result["category"])
+        if sort:
+            if not path:
+                path = write_new_file(sorter.DOWNLOAD_DIR, os.path.basename(filename), data)
+            result["path"] = sorter.sort_file_to_category(
+                path, category, text, self.rename_by_date, calendar_context=self.calendar_context
+            )
+        return result
+
+    @timed("daemon_messages")
+    def process_messages(self, message_ids):
+        results = {}
+        with self._gmail_lock:
+            for message_id in message_ids:
+                results[message_id] = sorter.process_message(
+                    self._service, message_id, self.rename_by_date, self.calendar_context
+                )
+        return results
+
+# -------------- HTTP API --------------
+class DaemonRequestHandler(BaseHTTPRequestHandler):
+    def _send_json(self, status, payload):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _read_body(self):
+        length = int(self.headers.get("Content-Length", 0))
+        return self.rfile.read(length) if length else b""
+
+    def _content_type(self):
+        return self.headers.get("Content-Type", "").split(";")[0].strip().lower()
+
+    def _read_json(self, body):
+        request = json.loads(body or b"{}")
+        if not isinstance(request, dict):
+            raise ValueError("JSON body must be an object")
+        return request
+
+    def do_GET(self):
+        path = urlparse(self.path).path
+        if path == "/health":
+            self._send_json(200, {"status": "ok"})
+        elif path == "/metrics":
+            body = METRICS.prometheus_text().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        else:
+            self._send_json(404, {"error": "Not found"})
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        state = self.server.state
+        try:
+            body = self._read_body()
+            # Browsers send text/plain and form posts cross-origin without a preflight, so every
+            # endpoint only accepts content types a web page can't send on its own
+            content_type = self._content_type()
+            if url.path == "/classify":
+                if content_type not in ("application/json", "application/pdf"):
+                    self._send_json(415, {"error": "Content-Type must be application/pdf or application/json"})
+                    return
+                if content_type == "application/json":
+                    request = self._read_json(body)
+                    if not request.get("path"):
+                        raise ValueError("JSON requests need a 'path' to a PDF")
+                    options = {**query, **request}
+                    result = state.classify_pdf(
+                        path=request["path"],
+                        sort=_flag(options.get("sort")),
+                        llm_fields=_flag(options.get("llm_fields")),
+                    )
+                else:
+                    if not body:
+                        raise ValueError("Empty request body")
+                    result = state.classify_pdf(
+                        data=body,
+                        filename=self.headers.get("X-Filename", "upload.pdf"),
+                        sort=_flag(query.get("sort")),
+                        llm_fields=_flag(query.get("llm_fields")),
+                    )
+                self._send_json(200, result)
+            elif url.path == "/messages":
+                if content_type != "application/json":
+                    self._send_json(415, {"error": "Content-Type must be application/json"})
+                    return
+                request = self._read_json(body)
+                message_ids = request.get("message_ids") or []
+                if not isinstance(message_ids, list) or not message_ids:
+                    raise ValueError("No message_ids given")
+                if not state.gmail_ready:
+                    self._send_json(503, {"error": state.gmail_error})
+                    return
+                self._send_json(200, {"results": state.process_messages(message_ids)})
+            else:
+                self._send_json(404, {"error": "Not found"})
+        except (ValueError, KeyError) as e:
+            self._send_json(400, {"error": str(e)})
+        except Exception as e:
+            print(f"[!] Daemon request failed: {e}")
+            self._send_json(500, {"error": str(e)})
+
+    def log_message(self, format, *args):
+        # client_address is empty on Unix sockets, so don't rely on address_string()
+        print(f"[i] {self.command} {self.path} - {format % args}")
+
+def _flag(value):
+    return str(value).lower() in ("1", "true", "yes", "on")
+
+class UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+def serve(host=DEFAULT_HOST, port=DEFAULT_PORT, socket_path=None, calendar_context=None, rename_by_date=False):
+    os.makedirs(sorter.DOWNLOAD_DIR, exist_ok=True)
+    os.makedirs(sorter.SORTED_DIR, exist_ok=True)
+    warm_up()
+    if socket_path:
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        server = UnixHTTPServer(socket_path, DaemonRequestHandler)
+        address = f"unix:{socket_path}"
+    else:
+        server = ThreadingHTTPServer((host, port), DaemonRequestHandler)
+        address = f"http://{host}:{port}"
+    server.state = DaemonState(calendar_context, rename_by_date)
+    server.state.connect_gmail()
+    print(f"[i] Daemon listening on {address} (Press Ctrl+C to stop)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\n[i] Stopping daemon.")
+    finally:
+        server.server_close()
+        if socket_path and os.path.exists(socket_path):
+            os.remove(socket_path)
@@ -0,0 +1,83 @@
+import os
+import shutil
+import threading
+
+# -------------- Per-Directory Name Allocator --------------
+class NameAllocator:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._taken = {}         # directory -> set of names in use
+        self._next_suffix = {}   # (directory, base, ext) -> next _N to try
+
+    def _names(self, directory):
+        names = self._taken.get(directory)
+        if names is None:
+            # Seed once from disk; afterwards every placement goes through reserve()
+            names = set(os.listdir(directory)) if os.path.isdir(directory) else set()
+            self._taken[directory] = names
+        return names
+
+    def reserve(self, directory, filename):
+        key_dir = os.path.abspath(directory)
+        base, ext = os.path.splitext(filename)
+        with self._lock:
+            names = self._names(key_dir)
+            if filename not in names:
+                names.add(filename)
+                return os.path.join(directory, filename)
+            key = (key_dir, base, ext)
+            counter = self._next_suffix.get(key, 1)
+            while f"{base}_{counter}{ext}" in names:
+                counter += 1
+            candidate = f"{base}_{counter}{ext}"
+            names.add(candidate)
+            self._next_suffix[key] = counter + 1
+            return os.path.join(directory, candidate)
+
+    def release(self, path):
+        directory, filename = os.path.split(os.path.abspath(path))
+        with self._lock:
+            self._taken.get(directory, set()).discard(filename)
+
+ALLOCATOR = NameAllocator()
+
+# -------------- Atomic Placement --------------
+def write_new_file(directory, filename, data):
+    while True:
+        path = ALLOCATOR.reserve(directory, filename)
+        try:
+            # 'xb' fails instead of overwriting a file created outside this process
+            with open(path, 'xb') as f:
+                f.write(data)
+            return path
+        except FileExistsError:
+            continue
+        except Exception:
+            ALLOCATOR.release(path)
+            raise
+
+def move_file(src_path, directory, filename):
+    while True:
+        path = ALLOCATOR.reserve(directory, filename)
+        try:
+            # A hard link never replaces an existing name, so link + unlink is an atomic no-clobber rename
+            os.link(src_path, path)
+        except FileExistsError:
+            continue
+        except OSError:
+            # No hard links here (e.g. FAT or another filesystem): rename, or copy across devices
+            if os.path.exists(path):
+                continue
+            try:
+                try:
+                    os.replace(src_path, path)
+                except OSError:
+                    shutil.move(src_path, path)
+            except Exception:
+                ALLOCATOR.release(path)
+                raise
+            ALLOCATOR.release(src_path)
+            return path
+        os.unlink(src_path)
+        ALLOCATOR.release(src_path)
+        return path
@@ -1,25 +1,31 @@
 import os
-import re
-import fitz
-import openai
-import ollama
-import pandas as pd
 import hashlib
 import json
 from concurrent.futures import ThreadPoolExecutor, as_completed
+from invoice_extraction import extract_invoice_fields_batch, date_from_filename
+from prompt_compaction import compact_invoice_text
+from metrics import timer, timed, count
+import llm
 
 REPORTS_DIR = "Reports"
 MODEL = "mistral"
 USE_OPENAI_KEY = os.getenv("USE_OPENAI", False)
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 OPENAI_MODEL = "gpt-3.5-turbo"
+LLM_FIELDS_MAX_TOKENS = 100  # response cap (num_predict / max_tokens)
 
 LLM_CACHE_FILE = "llm_cache.json"
-try:
-    with open(LLM_CACHE_FILE, "r") as f:
-        LLM_CACHE = json.load(f)
-except FileNotFoundError:
-    LLM_CACHE = {}
+LLM_CACHE = None  # loaded on first use by load_llm_cache()
+
+def load_llm_cache():
+    global LLM_CACHE
+    if LLM_CACHE is None:
+        try:
+            with open(LLM_CACHE_FILE, "r") as f:
+                LLM_CACHE = json.load(f)
+        except FileNotFoundError:
+            LLM_CACHE = {}
+    return LLM_CACHE
 
 def cache_key(text, language):
     return hashlib.sha256((text + language).encode()).hexdigest()
@@ -39,29 +45,17 @@ def get_column_mapping(language):
         "file_paths": "Dateipfade" if language == "de" else "File paths"
     }
 
-if USE_OPENAI_KEY and OPENAI_API_KEY:
-    openai.api_key = OPENAI_API_KEY
-
+@timed("pdf_extract")
 def extract_text_from_pdf(pdf_path):
+    import fitz
     doc = fitz.open(pdf_path)
-    return "\n".join(page.get_text() for page in doc)[:2000]
-
-def extract_date(text):
-    match = re.search(r'(\d{4})[.\-/](\d{1,2})[.\-/](\d{1,2})', text)
-    if match:
-        year, month, day = match.groups()
-        return f"{int(year):04d}-{int(month):02d}-{int(day):02d}"
-    return None
-
-def extract_amount(text):
-    match = re.search(r'(\d{1,4}[,.]\d{2}) ?€', text)
-    if match:
-        return match.group(1).replace(',', '.')
-    return None
+    return "\n".join(page.get_text() for page in doc)
 
 
 # Unified LLM function for extracting description, distance, and type
+@timed("llm_fields")
 def generate_llm_fields(text, category, event=None, language='en'):
+    text = compact_invoice_text(text)
     prompt = f"""
 You are a tax assistant helping to analyze receipts.
 
@@ -78,52 +72,110 @@ Invoice content:
 """
     if event:
         prompt += f"\n\nCalendar context: {event}"
-    if USE_OPENAI_KEY:
-        response = openai.ChatCompletion.create(
-            model=OPENAI_MODEL,
-            messages=[{"role": "user", "content": prompt}],
-            max_tokens=100
-        )
-        import json
-        try:
-            return json.loads(response.choices[0].message['content'])
-        except:
-            return {"anlass": "", "distance_km": 0, "type": ""}
-    else:
-        response = ollama.chat(model=MODEL, messages=[{"role": "user", "content": prompt}])
-        import json
-        try:
-            return json.loads(response['message']['content'])
-        except:
-            return {"anlass": "", "distance_km": 0, "type": ""}
+    content = llm.chat(prompt, MODEL, LLM_FIELDS_MAX_TOKENS, USE_OPENAI_KEY, OPENAI_MODEL)
+    try:
+        return json.loads(content)
+    except:
+        return {"anlass": "", "distance_km": 0, "type": ""}
+
+AMOUNT_KEYS = ["parking", "hotel", "transport", "meal", "fee"]
+ENTRY_KEYS = ["date", "location", "purpose", "duration", "distance_km"] + AMOUNT_KEYS + ["file_paths"]
+EXPORT_FORMATS = ["xlsx", "csv", "parquet"]
+PARQUET_ENGINES = ["pyarrow", "fastparquet"]  # pandas needs one of these for to_parquet()
+
+def check_export_formats(formats):
+    # Fail before any PDFs are processed instead of dropping a requested export at the end
+    unknown = [fmt for fmt in formats if fmt not in EXPORT_FORMATS]
+    if unknown:
+        raise ValueError(f"Unknown export format(s): {', '.join(unknown)}")
+    if "parquet" in formats:
+        from importlib.util import find_spec
+        if not any(find_spec(engine) for engine in PARQUET_ENGINES):
+            raise ValueError("Parquet export needs pyarrow or fastparquet installed (uv pip install pyarrow)")
 
-def generate_travel_report(year, sorted_dir, calendar_context, force_include=False, language='en', use_cache=False, use_parallel=False):
+def build_report_frame(entries):
+    import pandas as pd
+    df = pd.DataFrame(entries, columns=ENTRY_KEYS + ["category"])
+    numeric_keys = ["duration", "distance_km"] + AMOUNT_KEYS
+    df[numeric_keys] = df[numeric_keys].apply(pd.to_numeric, errors="coerce")
+    df["is_travel"] = df["category"].eq("Travel")
+
+    # Keep only days that include a Travel entry; meals on those days inherit its purpose
+    travel_days = df.groupby("date")["is_travel"].transform("any").astype(bool)
+    for date in sorted(df.loc[~travel_days, "date"].unique()):
+        print(f"[!] Skipping {date}: no Travel entry found")
+    df = df[travel_days].sort_values(["date", "is_travel"], ascending=[True, False], kind="stable")
+
+    grouped = df.groupby("date", sort=True)
+    daily = grouped[["location", "purpose", "duration", "distance_km"]].first()
+    daily[AMOUNT_KEYS] = grouped[AMOUNT_KEYS].sum(min_count=1).round(2)
+    daily["file_paths"] = grouped["file_paths"].agg("\n".join)
+    return daily.reset_index()[ENTRY_KEYS]
+
+def write_report_xlsx(df, path):
+    from openpyxl import Workbook
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet("Sheet1")
+    sheet.append(list(df.columns))
+    for row in df.astype(object).where(df.notna(), None).itertuples(index=False, name=None):
+        sheet.append(row)
+    workbook.save(path)
+
+def export_report(df, base_path, formats):
+    paths = []
+    for fmt in formats:
+        path = f"{base_path}.{fmt}"
+        if fmt == "xlsx":
+            write_report_xlsx(df, path)
+        elif fmt == "csv":
+            df.to_csv(path, index=False, encoding="utf-8")
+        elif fmt == "parquet":
+            df.to_parquet(path, index=False)
+        paths.append(path)
+    return paths
+
+def generate_travel_report(year, sorted_dir, calendar_context, force_include=False, language='en', use_cache=False, use_parallel=False, export_formats=("xlsx",)):
+    check_export_formats(export_formats)
     os.makedirs(REPORTS_DIR, exist_ok=True)
     processed_count = 0
     skipped_count = 0
 
-    # 1. Insert ExcelWriter setup at function start after os.makedirs
-    from openpyxl import load_workbook
-    from pandas import ExcelWriter
-    import tempfile
+    entries = []
+    llm_cache = load_llm_cache() if use_cache else {}
 
-    excel_temp_file = tempfile.NamedTemporaryFile(delete=False, suffix=".xlsx")
-    writer = ExcelWriter(excel_temp_file.name, engine='openpyxl')
-    current_row = 0
+    column_map = get_column_mapping(language)
 
-    entries_by_date = {}
+    # Date and amount come from the full text; the LLM only sees the compacted lines
+    invoices = []
+    for category in ["Travel", "Food"]:
+        dir_path = os.path.join(sorted_dir, category)
+        if not os.path.isdir(dir_path):
+            continue
+        for file in os.listdir(dir_path):
+            if not file.lower().endswith(".pdf"):
+                continue
+            invoices.append((os.path.join(dir_path, file), file, category))
 
-    column_map = get_column_mapping(language)
-    columns = list(column_map.values())
+    def read_text(path):
+        try:
+            return extract_text_from_pdf(path)
+        except Exception as e:
+            print(f"[!] Could not read {path}: {e}")
+            return None
 
-    def process_invoice(path, file, category, year, calendar_context, force_include, language):
-        text = extract_text_from_pdf(path)
-        date = extract_date(text)
-        if not date:
-            date_from_filename = re.search(r'(\d{4})[.\-_](\d{1,2})[.\-_](\d{1,2})', file)
-            if date_from_filename:
-                y, m, d = date_from_filename.groups()
-                date = f"{int(y):04d}-{int(m):02d}-{int(d):02d}"
+    if use_parallel:
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            texts = list(executor.map(read_text, [path for path, _, _ in invoices]))
+    else:
+        texts = [read_text(path) for path, _, _ in invoices]
+    readable = [(invoice, text) for invoice, text in zip(invoices, texts) if text is not None]
+    skipped_count += len(invoices) - len(readable)
+    with timer("field_extraction"):
+        all_fields = extract_invoice_fields_batch([text for _, text in readable])
+
+    def process_invoice(path, file, category, full_text, fields):
+        text = compact_invoice_text(full_text)
+        date = fields["date"] or date_from_filename(file)
 
         if not date:
             if not force_include:
@@ -137,52 +189,47 @@ def generate_travel_report(year, sorted_dir, calendar_context, force_include=Fal
             else:
                 date = f"{year}-01-01"
 
-        amount = extract_amount(text) or ""
+        amount = fields["amount"]
         event = None
         if calendar_context and date in calendar_context:
             event = ", ".join(calendar_context[date])
         key = cache_key(text, language)
-        if use_cache and key in LLM_CACHE:
-            llm_data = LLM_CACHE[key]
+        if use_cache and key in llm_cache:
+            llm_data = llm_cache[key]
+            count("llm_cache_hits")
         else:
+            if use_cache:
+                count("llm_cache_misses")
             llm_data = generate_llm_fields(text, category, event, language)
             if use_cache:
-                LLM_CACHE[key] = llm_data
+                llm_cache[key] = llm_data
                 with open(LLM_CACHE_FILE, "w") as f:
-                    json.dump(LLM_CACHE, f)
+                    json.dump(llm_cache, f)
         type_hint = llm_data.get("type", "").lower()
         entry = {
             "date": date,
             "location": "",
             "purpose": llm_data.get("anlass", event or ""),
-            "duration": 10 if category == "Travel" else "",
-            "distance_km": llm_data.get("distance_km", "") if category == "Travel" else "",
-            "parking": amount if "park" in type_hint else "",
-            "hotel": amount if "hotel" in type_hint else "",
-            "transport": amount if ("transport" in type_hint or "taxi" in type_hint or "bahn" in type_hint) else "",
-            "meal": amount if category == "Food" else "",
-            "fee": amount if "fee" in type_hint else "",
-            "file_paths": os.path.relpath(path)
+            "duration": 10 if category == "Travel" else None,
+            "distance_km": llm_data.get("distance_km") if category == "Travel" else None,
+            "parking": amount if "park" in type_hint else None,
+            "hotel": amount if "hotel" in type_hint else None,
+            "transport": amount if ("transport" in type_hint or "taxi" in type_hint or "bahn" in type_hint) else None,
+            "meal": amount if category == "Food" else None,
+            "fee": amount if "fee" in type_hint else None,
+            "file_paths": os.path.relpath(path),
+            "category": category
         }
         print(f"[•] Processed {file} ({category}) → Date: {date}")
-        return (date, entry), None
+        return entry, None
 
     if use_parallel:
         with ThreadPoolExecutor(max_workers=4) as executor:
-            futures = []
-            for category in ["Travel", "Food"]:
-                dir_path = os.path.join(sorted_dir, category)
-                if not os.path.isdir(dir_path):
-                    continue
-                for file in os.listdir(dir_path):
-                    if not file.lower().endswith(".pdf"):
-                        continue
-                    path = os.path.join(dir_path, file)
-                    futures.append(executor.submit(process_invoice, path, file, category, year, calendar_context, force_include, language))
-
+            futures = [executor.submit(process_invoice, *invoice, text, fields)
+                       for (invoice, text), fields in zip(readable, all_fields)]
             for future in as_completed(futures):
                 try:
-                    result, warning = future.result()
+                    entry, warning = future.result()
                 except Exception as e:
                     print(f"[!] Threaded processing error: {e}")
                     skipped_count += 1
@@ -191,72 +238,34 @@ def generate_travel_report(year, sorted_dir, calendar_context, force_include=Fal
                     print(warning)
                     skipped_count += 1
                     continue
-                if result:
-                    date, entry = result
-                    entries_by_date.setdefault(date, []).append(entry)
+                if entry:
+                    entries.append(entry)
                     processed_count += 1
     else:
-        for category in ["Travel", "Food"]:
-            dir_path = os.path.join(sorted_dir, category)
-            if not os.path.isdir(dir_path):
+        for (invoice, text), fields in zip(readable, all_fields):
+            entry, warning = process_invoice(*invoice, text, fields)
+            if warning:
+                print(warning)
+                skipped_count += 1
                 continue
-            for file in os.listdir(dir_path):
-                if not file.lower().endswith(".pdf"):
-                    continue
-                path = os.path.join(dir_path, file)
-                result, warning = process_invoice(path, file, category, year, calendar_context, force_include, language)
-                if warning:
-                    print(warning)
-                    skipped_count += 1
-                    continue
-                if result:
-                    date, entry = result
-                    entries_by_date.setdefault(date, []).append(entry)
-                    processed_count += 1
+            if entry:
+                entries.append(entry)
+                processed_count += 1
 
-    # Filter and link only days that include Travel (based on new structure: use "duration" as indicator)
-    filtered_entries = {}
-    for date, entries in entries_by_date.items():
-        travel_entry = next((e for e in entries if e.get("duration") == 10), None)
-        if not travel_entry:
-            print(f"[!] Skipping {date}: no Travel entry found")
-            continue
-        for entry in entries:
-            if entry.get("meal"):
-                entry["purpose"] = travel_entry["purpose"]
-                entry["location"] = travel_entry["location"]
-        filtered_entries[date] = entries
-
-    if not filtered_entries:
+    # Stable order regardless of thread completion, so reruns produce identical reports
+    entries.sort(key=lambda entry: entry["file_paths"])
+    with timer("report_assemble"):
+        report = build_report_frame(entries).rename(columns=column_map)
+    if report.empty:
         print("[!] No valid travel entries found. Report will be empty.")
 
-    # 2. Write directly to Excel as rows are processed
-    for date in sorted(filtered_entries.keys()):
-        # sort: travel entry (duration==10) first
-        daily_entries = sorted(filtered_entries[date], key=lambda e: e.get("duration", "") != 10)
-        if not daily_entries:
-            continue
-        merged = daily_entries[0]
-        for extra in daily_entries[1:]:
-            for key in ["parking", "hotel", "transport", "meal", "fee"]:
-                if extra.get(key):
-                    try:
-                        merged[key] = str(float(merged.get(key, 0)) + float(extra[key]))
-                    except:
-                        merged[key] = extra[key]
-            merged["file_paths"] += f"\n{extra['file_paths']}"
-        df_row = pd.DataFrame([{column_map[k]: v for k, v in merged.items()}], columns=columns)
-        df_row.to_excel(writer, index=False, header=(current_row == 0), startrow=current_row)
-        current_row += 1
-
-    # 3. Finalize ExcelWriter and print output
-    writer.close()
     if language == 'de':
-        final_path = os.path.join(REPORTS_DIR, f"reisekosten_{year}_de.xlsx")
+        base_path = os.path.join(REPORTS_DIR, f"reisekosten_{year}_de")
     else:
-        final_path = os.path.join(REPORTS_DIR, f"travel_report_{year}_en.xlsx")
-    import shutil
-    shutil.move(excel_temp_file.name, final_path)
-    print(f"[✓] Travel report generated: {final_path}")
+        base_path = os.path.join(REPORTS_DIR, f"travel_report_{year}_en")
+    with timer("report_export"):
+        paths = export_report(report, base_path, export_formats)
+    for path in paths:
+        print(f"[✓] Travel report generated: {path}")
     print(f"[✓] Processed entries: {processed_count}")
-    print(f"[•] Skipped files: {skipped_count}")
\ No newline at end of file
+    print(f"[•] Skipped files: {skipped_count}")
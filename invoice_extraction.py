@@ -0,0 +1,147 @@
+import re
+from datetime import date as _date
+
+# -------------- Month Names (German + English) --------------
+MONTHS = {
+    "januar": 1, "january": 1, "jan": 1,
+    "februar": 2, "february": 2, "feb": 2,
+    "märz": 3, "maerz": 3, "march": 3, "mär": 3, "mar": 3,
+    "april": 4, "apr": 4,
+    "mai": 5, "may": 5,
+    "juni": 6, "june": 6, "jun": 6,
+    "juli": 7, "july": 7, "jul": 7,
+    "august": 8, "aug": 8,
+    "september": 9, "sept": 9, "sep": 9,
+    "oktober": 10, "october": 10, "okt": 10, "oct": 10,
+    "november": 11, "nov": 11,
+    "dezember": 12, "december": 12, "dez": 12, "dec": 12,
+}
+_MONTH_NAMES = "|".join(sorted(MONTHS, key=len, reverse=True))
+
+# -------------- Precompiled Patterns --------------
+DATE_PATTERN = re.compile(
+    r'(?<![\d.])(?:'
+    r'(?P<iso_y>\d{4})[.\-/](?P<iso_m>\d{1,2})[.\-/](?P<iso_d>\d{1,2})'
+    r'|(?P<dmy_d>\d{1,2})[.\-/](?P<dmy_m>\d{1,2})[.\-/](?P<dmy_y>\d{4}|\d{2})'
+    rf'|(?P<tdmy_d>\d{{1,2}})\.?\s+(?P<tdmy_m>{_MONTH_NAMES})\.?\s+(?P<tdmy_y>\d{{4}})'
+    rf'|(?P<tmdy_m>{_MONTH_NAMES})\.?\s+(?P<tmdy_d>\d{{1,2}}),?\s+(?P<tmdy_y>\d{{4}})'
+    r')(?![\d])',
+    re.IGNORECASE,
+)
+FILENAME_DATE_PATTERN = re.compile(r'(\d{4})[.\-_](\d{1,2})[.\-_](\d{1,2})')
+
+_NUMBER = r'\d{1,3}(?:\.\d{3})+,\d{2}|\d{1,3}(?:,\d{3})+\.\d{2}|\d+[.,]\d{2}'
+_CURRENCY = r'€|EUR\b|Euro\b'
+AMOUNT_PATTERN = re.compile(
+    rf'(?:(?P<pre>{_CURRENCY})\s?)?(?<![\d.,])(?P<number>{_NUMBER})(?![.,]?\d)(?:\s?(?P<post>{_CURRENCY}))?',
+    re.IGNORECASE,
+)
+
+# Labels ranked so that invoice dates beat due dates and grand totals beat line items
+DATE_LABELS = [
+    (re.compile(r'rechnungsdatum|belegdatum|ausstellungsdatum|kaufdatum|bestelldatum|invoice date|date of issue|issue date|order date', re.IGNORECASE), 3),
+    (re.compile(r'\bdatum\b|\bdate\b', re.IGNORECASE), 2),
+    (re.compile(r'leistungsdatum|lieferdatum|reisedatum|service date|delivery date|travel date', re.IGNORECASE), 1),
+    (re.compile(r'fällig|faellig|zahlbar bis|zahlungsziel|due|payable by|gültig bis|valid until', re.IGNORECASE), -3),
+]
+AMOUNT_LABELS = [
+    (re.compile(r'gesamtbetrag|gesamtsumme|endbetrag|rechnungsbetrag|zahlbetrag|zu zahlen|grand total|amount due|total due|amount paid', re.IGNORECASE), 3),
+    (re.compile(r'\bsumme\b|\bgesamt\b|\btotal\b|\bbrutto\b|\bbetrag\b', re.IGNORECASE), 2),
+    (re.compile(r'zwischensumme|subtotal|\bnetto\b|\bnet\b|\bmwst\b|\bust\b|\bvat\b|\btax\b|steuer|rabatt|discount|trinkgeld|\btip\b', re.IGNORECASE), -2),
+    # Cash tendered and change on receipts are not what was paid
+    (re.compile(r'gegeben|rückgeld|rueckgeld|\bchange\b|\bbar\b|\bcash\b', re.IGNORECASE), -2),
+]
+
+# -------------- Candidate Ranking --------------
+def _label_score(line, labels):
+    positive = max((score for pattern, score in labels if score > 0 and pattern.search(line)), default=0)
+    negative = min((score for pattern, score in labels if score < 0 and pattern.search(line)), default=0)
+    return positive + negative
+
+def _scored_matches(text, labels, pattern):
+    # Each match is scored by the label text to its left on the same line; a label on the previous
+    # line only counts when that line had no value of its own (common in PDF text)
+    previous_score = 0
+    position = 0
+    for line in text.splitlines():
+        if not line.strip():
+            continue
+        line_score = _label_score(line, labels)
+        matches = list(pattern.finditer(line))
+        segment_start = 0
+        for match in matches:
+            score = _label_score(line[segment_start:match.start()], labels) or line_score or previous_score
+            yield position, match.start(), score, match
+            segment_start = match.end()
+        previous_score = 0 if matches else line_score
+        position += 1
+
+def _to_date(match):
+    groups = match.groupdict()
+    for prefix in ("iso", "dmy", "tdmy", "tmdy"):
+        if groups[f"{prefix}_y"] is None:
+            continue
+        year, month, day = groups[f"{prefix}_y"], groups[f"{prefix}_m"], groups[f"{prefix}_d"]
+        if len(year) == 2:
+            year = "20" + year
+        month = MONTHS.get(month.lower()) if not month.isdigit() else int(month)
+        try:
+            return _date(int(year), month, int(day))
+        except (TypeError, ValueError):
+            return None
+    return None
+
+def _to_amount(number):
+    decimal_sep = number[-3]
+    thousands_sep = "," if decimal_sep == "." else "."
+    return float(number.replace(thousands_sep, "").replace(decimal_sep, "."))
+
+def date_candidates(text):
+    candidates = []
+    for position, offset, score, match in _scored_matches(text, DATE_LABELS, DATE_PATTERN):
+        value = _to_date(match)
+        if value and 1990 <= value.year <= 2099:
+            # Ties go to the earliest date in reading order
+            candidates.append((score, -position, -offset, value))
+    return candidates
+
+def amount_candidates(text):
+    candidates = []
+    for _, _, score, match in _scored_matches(text, AMOUNT_LABELS, AMOUNT_PATTERN):
+        # Bare numbers only count on labelled lines; otherwise require a currency marker
+        if not (match.group("pre") or match.group("post") or score > 0):
+            continue
+        candidates.append((score, _to_amount(match.group("number"))))
+    return candidates
+
+# -------------- Public API --------------
+def extract_date(text):
+    candidates = date_candidates(text or "")
+    if not candidates:
+        return None
+    return max(candidates)[3].isoformat()
+
+def extract_amount(text):
+    candidates = amount_candidates(text or "")
+    if not candidates:
+        return None
+    return max(candidates)[1]
+
+def date_from_filename(filename):
+    match = FILENAME_DATE_PATTERN.search(filename)
+    if not match:
+        return None
+    year, month, day = match.groups()
+    return f"{int(year):04d}-{int(month):02d}-{int(day):02d}"
+
+def extract_invoice_fields(text):
+    return {"date": extract_date(text), "amount": extract_amount(text)}
+
+def extract_invoice_fields_batch(texts, max_workers=None, chunksize=32):
+    texts = list(texts)
+    # Regex matching holds the GIL, so large batches are spread over processes
+    if max_workers == 1 or len(texts) < chunksize * 2:
+        return [extract_invoice_fields(text) for text in texts]
+    from concurrent.futures import ProcessPoolExecutor
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        return list(executor.map(extract_invoice_fields, texts, chunksize=chunksize))
@@ -0,0 +1,24 @@
+import os
+from cassette import through
+from metrics import count
+from prompt_compaction import estimate_tokens
+
+# -------------- Unified Chat Call --------------
+def chat(prompt, model, max_tokens, use_openai=False, openai_model="gpt-3.5-turbo"):
+    def call():
+        count("llm_calls")
+        count("prompt_tokens", estimate_tokens(prompt))
+        if use_openai:
+            import openai
+            openai.api_key = os.getenv("OPENAI_API_KEY") or openai.api_key
+            response = openai.ChatCompletion.create(
+                model=openai_model,
+                messages=[{"role": "user", "content": prompt}],
+                max_tokens=max_tokens
+            )
+            return response.choices[0].message['content']
+        import ollama
+        response = ollama.chat(model=model, messages=[{"role": "user", "content": prompt}], options={"num_predict": max_tokens})
+        return response['message']['content']
+
+    return through("llm", [openai_model if use_openai else model, prompt, max_tokens], call)
@@ -2,22 +2,19 @@ import os
 import time
 import pickle
 import base64
-import shutil
-import fitz
-import ollama
 import re
-from bs4 import BeautifulSoup
-import requests
-import openai
 from dotenv import load_dotenv
-from googleapiclient.discovery import build
-from google_auth_oauthlib.flow import InstalledAppFlow
 import argparse
 import csv
-from concurrent.futures import ThreadPoolExecutor, as_completed
-from watchdog.observers import Observer
-from watchdog.events import FileSystemEventHandler
-from ics import Calendar
+from concurrent.futures import ThreadPoolExecutor
+# Heavy dependencies (fitz, ollama, openai, bs4, requests, googleapiclient, watchdog, ics)
+# are imported inside the functions that use them so each subcommand only pays for its own.
+from invoice_extraction import extract_date, extract_invoice_fields
+from prompt_compaction import compact_invoice_text
+from file_placement import write_new_file, move_file
+from metrics import METRICS, timer, timed, count, profile_call
+from cassette import use_cassette, gmail_service, http_get, through, replaying, RECORD, REPLAY
+import llm
 
 def load_reviewed_ids(file_path="review_queue.csv"):
     if not os.path.exists(file_path):
@@ -40,6 +37,8 @@ if not OPENAI_API_KEY and USE_OPENAI_KEY:
     raise ValueError("OPENAI_API_KEY must be set if USE_OPENAI_KEY is True")
 
 OPENAI_MODEL = "gpt-3.5-turbo"
+CATEGORY_MAX_TOKENS = 10  # response caps (num_predict / max_tokens)
+LINKS_MAX_TOKENS = 400
 
 CALENDAR_CONTEXT = {}
 
@@ -63,10 +62,9 @@ BLACKLISTED_SENDERS = [
     "noreply@apple.com"
 ]
 
-if USE_OPENAI_KEY:
-    openai.api_key = OPENAI_API_KEY
-
 def write_to_review_queue(subject, url, reason, message_id=None):
+    if replaying():
+        return  # the queue belongs to the recorded run; replays must not add to it
     file_path = "review_queue.csv"
     entry = (subject.strip(), url.strip())
 
@@ -89,6 +87,7 @@ def write_to_review_queue(subject, url, reason, message_id=None):
             writer.writerow(["Subject", "URL", "Reason", "Gmail Link"])
         link = f"https://mail.google.com/mail/u/0/#inbox/{message_id}" if message_id else "N/A"
         writer.writerow([subject, url, reason, link])
+    count("review_queue_entries")
 
 def build_search_query(keywords, timeframe, start_date=None):
     keyword_part = " OR ".join(keywords)
@@ -98,6 +97,8 @@ def build_search_query(keywords, timeframe, start_date=None):
 
 # -------------- Gmail Auth --------------
 def gmail_authenticate():
+    from googleapiclient.discovery import build
+    from google_auth_oauthlib.flow import InstalledAppFlow
     creds = None
     if os.path.exists('token.pickle'):
         with open('token.pickle', 'rb') as token:
@@ -110,6 +111,7 @@ def gmail_authenticate():
     return build('gmail', 'v1', credentials=creds)
 
 # -------------- Gmail Message Search --------------
+@timed("gmail_search")
 def search_messages(service, query):
     all_messages = []
     next_page_token = None
@@ -131,24 +133,19 @@ def search_messages(service, query):
 
 # -------------- Download PDF Attachments --------------
 def download_attachments(service, message_id, save_dir):
-    message = service.users().messages().get(userId='me', id=message_id, format='full').execute()
+    with timer("gmail_fetch"):
+        message = service.users().messages().get(userId='me', id=message_id, format='full').execute()
     found = False
     for part in message['payload'].get('parts', []):
         if part['filename'].lower().endswith('.pdf') and 'attachmentId' in part['body']:
             found = True
             attachment_id = part['body']['attachmentId']
-            attachment = service.users().messages().attachments().get(
-                userId='me', messageId=message_id, id=attachment_id).execute()
+            with timer("gmail_attachment"):
+                attachment = service.users().messages().attachments().get(
+                    userId='me', messageId=message_id, id=attachment_id).execute()
             data = base64.urlsafe_b64decode(attachment['data'].encode('UTF-8'))
-            filename = part['filename']
-            filepath = os.path.join(save_dir, filename)
-            base, ext = os.path.splitext(filepath)
-            counter = 1
-            while os.path.exists(filepath):
-                filepath = f"{base}_{counter}{ext}"
-                counter += 1
-            with open(filepath, 'wb') as f:
-                f.write(data)
+            count("bytes_downloaded", len(data))
+            filepath = write_new_file(save_dir, part['filename'], data)
             print(f"[✓] Downloaded: {filepath}")
             yield filepath
     if not found:
@@ -159,14 +156,16 @@ def download_attachments(service, message_id, save_dir):
                 break
         write_to_review_queue(subject, "(no attachment)", "No PDF attachments", message_id)
 # -------------- Extract Text from PDF --------------
+@timed("pdf_extract")
 def extract_text_from_pdf(pdf_path):
+    import fitz
     doc = fitz.open(pdf_path)
-    text = "\n".join(page.get_text() for page in doc)
-    return text[:2000]  # limit for faster LLM
+    return "\n".join(page.get_text() for page in doc)
 
 # -------------- Extract Invoice Links with Ollama --------------
 def extract_invoice_links_with_ollama(service, message_id):
-    message = service.users().messages().get(userId='me', id=message_id, format='full').execute()
+    with timer("gmail_fetch"):
+        message = service.users().messages().get(userId='me', id=message_id, format='full').execute()
     parts = message['payload'].get('parts', [])
     body = ''
     for part in parts:
@@ -175,6 +174,7 @@ def extract_invoice_links_with_ollama(service, message_id):
         elif part.get('mimeType') == 'text/html' and 'data' in part.get('body', {}):
             body += base64.urlsafe_b64decode(part['body']['data']).decode('utf-8')
 
+    from bs4 import BeautifulSoup
     soup = BeautifulSoup(body, 'html.parser')
     candidates = []
     for a in soup.find_all('a'):
@@ -194,8 +194,8 @@ Links:
 
 PDF Links:
 """
-    response = ollama.chat(model=MODEL, messages=[{"role": "user", "content": prompt}])
-    text = response['message']['content']
+    with timer("llm_links"):
+        text = llm.chat(prompt, MODEL, LINKS_MAX_TOKENS)
     raw_urls = re.findall(r'https?://\S+', text)
     urls = []
     for url in raw_urls:
@@ -212,9 +212,13 @@ PDF Links:
     return urls
 
 # -------------- Download PDF from URL --------------
-def download_pdf_from_url(url, save_dir, subject=None, message_id=None):
+@timed("pdf_download")
+def fetch_pdf_from_url(url, subject=None, message_id=None):
+    # Returns (filename, content); writing the file is left to the caller so names can be
+    # assigned in a fixed order even when links are fetched in parallel
+    filename = os.path.basename(url.split("?")[0])
     try:
-        response = requests.get(url, timeout=2)
+        response = http_get(url, timeout=2)
         content_type = response.headers.get('content-type', '')
         if not response.content.strip():
             print(f"[!] Skipped empty file from {url}")
@@ -222,17 +226,8 @@ def download_pdf_from_url(url, save_dir, subject=None, message_id=None):
                 write_to_review_queue(subject, url, "Empty response content", message_id)
             return None
         if content_type.startswith('application/pdf'):
-            filename = os.path.basename(url.split("?")[0])
-            filepath = os.path.join(save_dir, filename)
-            base, ext = os.path.splitext(filepath)
-            counter = 1
-            while os.path.exists(filepath):
-                filepath = f"{base}_{counter}{ext}"
-                counter += 1
-            with open(filepath, 'wb') as f:
-                f.write(response.content)
-            print(f"[✓] Downloaded from link: {filepath}")
-            return filepath
+            count("bytes_downloaded", len(response.content))
+            return filename, response.content
         else:
             print(f"[!] Unexpected content-type from {url}: {content_type}")
             if subject:
@@ -242,23 +237,18 @@ def download_pdf_from_url(url, save_dir, subject=None, message_id=None):
         if subject:
             write_to_review_queue(subject, url, str(e), message_id)
     try:
-        import browser_cookie3
         print(f"[i] Retrying with browser session cookies for {url}")
-        cj = browser_cookie3.load()
-        response = requests.get(url, cookies=cj, timeout=4)
+        if replaying():
+            cj = None  # the recorded response is looked up without reading live cookies
+        else:
+            import browser_cookie3
+            cj = browser_cookie3.load()
+        response = http_get(url, cookies=cj, timeout=4)
         content_type = response.headers.get('content-type', '')
         if response.content.strip() and content_type.startswith('application/pdf'):
-            filename = os.path.basename(url.split("?")[0])
-            filepath = os.path.join(save_dir, filename)
-            base, ext = os.path.splitext(filepath)
-            counter = 1
-            while os.path.exists(filepath):
-                filepath = f"{base}_{counter}{ext}"
-                counter += 1
-            with open(filepath, 'wb') as f:
-                f.write(response.content)
-            print(f"[✓] Downloaded using session cookies: {filepath}")
-            return filepath
+            count("bytes_downloaded", len(response.content))
+            print(f"[✓] Fetched using session cookies: {url}")
+            return filename, response.content
         else:
             print(f"[!] Still not a valid PDF. Content-Type: {content_type}")
             if subject:
@@ -270,7 +260,10 @@ def download_pdf_from_url(url, save_dir, subject=None, message_id=None):
     return None
 
 # -------------- Categorize Invoice --------------
-def categorize_invoice(text, model=MODEL):
+@timed("categorize_invoice")
+def categorize_invoice(text, model=MODEL, compact=True):
+    if compact:
+        text = compact_invoice_text(text)
     prompt = f"""
 You are an invoice assistant. Categorize this invoice into one of the following categories:
 
@@ -288,16 +281,7 @@ Invoice:
 
 Category:
 """
-    if USE_OPENAI_KEY:
-        response = openai.ChatCompletion.create(
-            model=OPENAI_MODEL,
-            messages=[{"role": "user", "content": prompt}],
-            max_tokens=10
-        )
-        return response.choices[0].message['content'].strip()
-    else:
-        response = ollama.chat(model=model, messages=[{"role": "user", "content": prompt}])
-        return response['message']['content'].strip()
+    return llm.chat(prompt, model, CATEGORY_MAX_TOKENS, USE_OPENAI_KEY, OPENAI_MODEL).strip()
 
 # -------------- Sort File to Category Folder --------------
 def sort_file_to_category(file_path, category, text=None, rename_by_date=False, base_dir=SORTED_DIR, calendar_context=None):
@@ -308,12 +292,8 @@ def sort_file_to_category(file_path, category, text=None, rename_by_date=False,
     filename = os.path.basename(file_path)
 
     if rename_by_date and text:
-        match = re.search(r'(\d{1,2})[.\-/](\d{1,2})[.\-/](\d{2,4})', text)
-        if match:
-            day, month, year = match.groups()
-            if len(year) == 2:
-                year = '20' + year
-            date_key = f"{year}-{int(month):02d}-{int(day):02d}"
+        date_key = extract_date(text)
+        if date_key:
             filename = f"{date_key}.pdf"
 
             if calendar_context and date_key in calendar_context:
@@ -325,34 +305,20 @@ def sort_file_to_category(file_path, category, text=None, rename_by_date=False,
                 If none are relevant to the invoice, return nothing.
                 """
                 try:
-                    if USE_OPENAI_KEY:
-                        response = openai.ChatCompletion.create(
-                            model=OPENAI_MODEL,
-                            messages=[{"role": "user", "content": prompt}],
-                            max_tokens=10
-                        )
-                        suffix = response.choices[0].message['content'].strip()
-                    else:
-                        response = ollama.chat(model=MODEL, messages=[{"role": "user", "content": prompt}])
-                        suffix = response['message']['content'].strip()
-
+                    suffix = llm.chat(prompt, MODEL, CATEGORY_MAX_TOKENS, USE_OPENAI_KEY, OPENAI_MODEL).strip()
                     if suffix:
                         filename = f"{date_key}-{suffix}.pdf"
                 except Exception as e:
                     print(f"[!] Failed to fetch calendar context from LLM: {e}")
 
-    new_path = os.path.join(dest_dir, filename)
-    base, ext = os.path.splitext(new_path)
-    counter = 1
-    while os.path.exists(new_path):
-        new_path = f"{base}_{counter}{ext}"
-        counter += 1
-
-    shutil.move(file_path, new_path)
+    new_path = move_file(file_path, dest_dir, filename)
     print(f"[→] Sorted into: {category} as {os.path.basename(new_path)}")
+    count("documents_sorted")
+    return new_path
 
 # -------------- Calendar Context Loader --------------
 def load_calendar_context(ics_paths):
+    from ics import Calendar
     calendar_lookup = {}
     for path in ics_paths:
         if not os.path.exists(path):
@@ -369,12 +335,15 @@ def load_calendar_context(ics_paths):
     return calendar_lookup
 
 # -------------- Process Dropped Invoices --------------
-class InvoiceHandler(FileSystemEventHandler):
+class InvoiceHandler:
+    # Duck-typed watchdog handler so watchdog is only imported when watching
     def __init__(self, rename_by_date=False, calendar_context=None):
-        super().__init__()
         self.rename_by_date = rename_by_date
         self.calendar_context = calendar_context
 
+    def dispatch(self, event):
+        self.on_any_event(event)
+
     def on_any_event(self, event):
         if event.event_type not in ('created', 'moved'):
             return
@@ -411,8 +380,7 @@ def clean_up_download_dir():
                 src_path = os.path.join(root, file)
                 dest_dir = os.path.join(SORTED_DIR, "Other")
                 os.makedirs(dest_dir, exist_ok=True)
-                dest_path = os.path.join(dest_dir, os.path.basename(file))
-                shutil.move(src_path, dest_path)
+                move_file(src_path, dest_dir, os.path.basename(file))
                 print(f"[→] Moved non-PDF to Other: {file}")
 
     # Delete empty folders
@@ -423,7 +391,7 @@ def clean_up_download_dir():
                 os.rmdir(folder_path)
                 print(f"[✗] Deleted empty folder: {folder_path}")
 
-def process_dropped_invoices(rename_by_date=False, calendar_context=None):
+def process_dropped_invoices(rename_by_date=False, calendar_context=None, watch=True):
     print(f"\n[i] Checking existing files in {DOWNLOAD_DIR} before watching for changes...")
     for root, _, files in os.walk(DOWNLOAD_DIR):
         for file in files:
@@ -443,7 +411,10 @@ def process_dropped_invoices(rename_by_date=False, calendar_context=None):
                     print(f"[!] Error processing {fname}: {e}")
     # Clean up after initial scan
     clean_up_download_dir()
+    if not watch:
+        return
     print(f"\n[i] Watching {DOWNLOAD_DIR} for new PDFs and folders using watchdog... (Press Ctrl+C to stop)")
+    from watchdog.observers import Observer
     event_handler = InvoiceHandler(rename_by_date=rename_by_date, calendar_context=calendar_context)
     observer = Observer()
     # Set recursive=True to watch new folders dropped into DOWNLOAD_DIR
@@ -460,28 +431,182 @@ def process_dropped_invoices(rename_by_date=False, calendar_context=None):
         clean_up_download_dir()
         observer.join()
 
-# -------------- MAIN WORKFLOW --------------
-def main():
+# -------------- Process Gmail Message --------------
+def classify_file(file_path):
+    text = extract_text_from_pdf(file_path)
+    return text, categorize_invoice(text)
+
+def categorize_and_sort(file_path, rename_by_date=False, calendar_context=None, classified=None):
+    text, category = classified or classify_file(file_path)
+    print(f"[i] Categorizing file: {file_path}")
+    print(f"[i] Extracted text preview: {text[:100]}...")
+    new_path = sort_file_to_category(file_path, category, text, rename_by_date, calendar_context=calendar_context)
+    return {"path": new_path, "category": os.path.basename(os.path.dirname(new_path))}
+
+def process_message(service, message_id, rename_by_date=False, calendar_context=None):
+    with timer("gmail_fetch"):
+        full_message = service.users().messages().get(userId='me', id=message_id, format='full').execute()
+    subject = "No Subject"
+    for header in full_message['payload'].get('headers', []):
+        if header['name'] == 'Subject':
+            subject = header['value']
+            break
+    sender = ""
+    for header in full_message['payload'].get('headers', []):
+        if header['name'].lower() == 'from':
+            sender = header['value']
+            break
+    if any(blacklisted in sender for blacklisted in BLACKLISTED_SENDERS):
+        print(f"[→] Skipping blacklisted sender: {sender}")
+        return []
+    print(f"\n--- Processing email: {subject} ---")
+    count("emails_processed")
+
+    results = []
+    for file_path in download_attachments(service, message_id, DOWNLOAD_DIR):
+        results.append(categorize_and_sort(file_path, rename_by_date, calendar_context))
+
+    links = extract_invoice_links_with_ollama(service, message_id)
+    if links:
+        # Fetching and categorizing run in parallel, but files are named and sorted in link order:
+        # _1/_2 suffixes for links sharing a basename or date must not depend on thread timing,
+        # otherwise a replay can swap file contents between names
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            downloads = list(executor.map(lambda link: fetch_pdf_from_url(link, subject, message_id), links))
+            file_paths = []
+            for download in downloads:
+                if download:
+                    file_paths.append(write_new_file(DOWNLOAD_DIR, *download))
+                    print(f"[✓] Downloaded from link: {file_paths[-1]}")
+            classified = list(executor.map(classify_file, file_paths))
+        for file_path, result in zip(file_paths, classified):
+            results.append(categorize_and_sort(file_path, rename_by_date, calendar_context, result))
+        if not file_paths:
+            print("[!] All extracted links failed to download.")
+    return results
+
+# -------------- Subcommands --------------
+def scan_gmail(args):
+    # Recorded with the cassette so a replay skips exactly the emails the recorded run skipped
+    reviewed_ids = set(through("run", ["reviewed_ids"], lambda: sorted(load_reviewed_ids())))
+    service = gmail_service(gmail_authenticate)
+    search_query = build_search_query(KEYWORDS, TIMEFRAME, START_DATE)
+    print(f"[i] Gmail search query: {search_query}")
+    messages = search_messages(service, search_query)
+    print(f"[i] Found {len(messages)} matching emails.")
+
+    for msg in messages:
+        if msg['id'] in reviewed_ids:
+            print(f"[→] Skipping already reviewed email ID: {msg['id']}")
+            continue
+        process_message(service, msg['id'], args.rename_by_date, CALENDAR_CONTEXT)
+
+def watch(args):
+    process_dropped_invoices(rename_by_date=args.rename_by_date, calendar_context=CALENDAR_CONTEXT)
+
+def report(args):
+    from generate_reisekosten_excel import generate_travel_report
+    generate_travel_report(
+        args.year,
+        SORTED_DIR,
+        CALENDAR_CONTEXT,
+        language=args.lang,
+        use_cache=args.use_cache,
+        use_parallel=args.parallel,
+        export_formats=args.report_format
+    )
+
+def full_run(args):
+    if not args.year:
+        from datetime import datetime
+        args.year = datetime.now().year
+    scan_gmail(args)
+    # Sort PDFs already waiting in temp_invoices/ so the report includes them, then keep watching
+    process_dropped_invoices(rename_by_date=args.rename_by_date, calendar_context=CALENDAR_CONTEXT, watch=False)
+    report(args)
+    watch(args)
+
+def profile_document(args):
+    def classify_document(pdf_path):
+        text = extract_text_from_pdf(pdf_path)
+        category = categorize_invoice(text)
+        print(f"[i] {os.path.basename(pdf_path)} → {category}, {extract_invoice_fields(text)}")
+        return category
+    profile_call(args.output, classify_document, args.pdf)
+
+def serve_daemon(args):
+    from daemon import serve
+    serve(args.host, args.port, args.socket, CALENDAR_CONTEXT, rename_by_date=args.rename_by_date)
+
+def build_parser():
+    sorting = argparse.ArgumentParser(add_help=False)
+    sorting.add_argument('--rename-by-date', action='store_true', help='Rename files using extracted date and category')
+    sorting.add_argument('--calendar-context', nargs='*', help='ICS calendar files to use for filename context')
+
+    reporting = argparse.ArgumentParser(add_help=False)
+    reporting.add_argument('--lang', default='en', choices=['de', 'en'], help='Language for Reisekosten report export (en or de)')
+    reporting.add_argument('--report-format', nargs='+', default=['xlsx'], choices=['xlsx', 'csv', 'parquet'], help='Export format(s) for the travel report')
+    reporting.add_argument('--use-cache', action='store_true', help='Enable LLM response caching')
+    reporting.add_argument('--parallel', action='store_true', help='Enable multithreaded invoice processing')
+
+    instrumentation = argparse.ArgumentParser(add_help=False)
+    instrumentation.add_argument('--metrics-json', help='Append per-stage timings and counters as JSON lines to this file')
+    instrumentation.add_argument('--metrics-prom', help='Write run metrics in Prometheus textfile format to this file')
+
+    recording = argparse.ArgumentParser(add_help=False)
+    cassette_mode = recording.add_mutually_exclusive_group()
+    cassette_mode.add_argument('--record', metavar='CASSETTE', help='Record Gmail payloads, downloads and LLM responses into this cassette file')
+    cassette_mode.add_argument('--replay', metavar='CASSETTE', help='Run offline from a recorded cassette file')
+
     parser = argparse.ArgumentParser()
-    parser.add_argument('--scan-gmail', action='store_true', help='Enable scanning Gmail for invoice attachments and links')
-    parser.add_argument('--process-local', action='store_true', help='Enable processing of local PDFs from temp_invoices/')
-    parser.add_argument('--rename-by-date', action='store_true', help='Rename files using extracted date and category')
-    parser.add_argument('--calendar-context', nargs='*', help='ICS calendar files to use for filename context')
-    parser.add_argument('--generate-travel-report', type=int, help='Generate Reisekosten Excel report for the given year')
-    parser.add_argument('--full-run', action='store_true', help='Run Gmail scan, local processing, and travel report generation')
-    parser.add_argument('--lang', default='en', choices=['de', 'en'], help='Language for Reisekosten report export (en or de)')
-    parser.add_argument('--use-cache', action='store_true', help='Enable LLM response caching')
-    parser.add_argument('--parallel', action='store_true', help='Enable multithreaded invoice processing')
-    args = parser.parse_args()
-
-    # If --full-run is used, enable all three modes
-    if args.full_run:
-        args.scan_gmail = True
-        args.process_local = True
-        if not args.generate_travel_report:
-            from datetime import datetime
-            args.generate_travel_report = datetime.now().year
-    reviewed_ids = load_reviewed_ids()
+    subcommands = parser.add_subparsers(dest='command', required=True)
+
+    subcommand = subcommands.add_parser('scan-gmail', parents=[sorting, recording, instrumentation], help='Scan Gmail for invoice attachments and links')
+    subcommand.set_defaults(func=scan_gmail)
+
+    subcommand = subcommands.add_parser('watch', parents=[sorting, recording, instrumentation], help='Process local PDFs from temp_invoices/ and watch for new ones')
+    subcommand.set_defaults(func=watch)
+
+    subcommand = subcommands.add_parser('report', parents=[reporting, recording, instrumentation], help='Generate Reisekosten report for the given year')
+    subcommand.add_argument('year', type=int, help='Year to report on')
+    subcommand.add_argument('--calendar-context', nargs='*', help='ICS calendar files to use as purpose context')
+    subcommand.set_defaults(func=report)
+
+    subcommand = subcommands.add_parser('full-run', parents=[sorting, reporting, recording, instrumentation], help='Run Gmail scan and local processing, generate the travel report, then watch for new files')
+    subcommand.add_argument('--year', type=int, help='Year for the travel report (default: current year)')
+    subcommand.set_defaults(func=full_run)
+
+    subcommand = subcommands.add_parser('daemon', parents=[sorting, instrumentation], help='Keep models and Gmail warm and serve a local classification API')
+    subcommand.add_argument('--host', default='127.0.0.1', help='Host for the daemon HTTP API')
+    subcommand.add_argument('--port', type=int, default=8765, help='Port for the daemon HTTP API')
+    subcommand.add_argument('--socket', help='Serve the daemon API on this Unix socket instead of host/port')
+    subcommand.set_defaults(func=serve_daemon)
+
+    subcommand = subcommands.add_parser('profile', parents=[instrumentation], help='Profile extraction and categorization of a single PDF with cProfile')
+    subcommand.add_argument('pdf', help='PDF file to profile (it is not moved)')
+    subcommand.add_argument('--output', default='invoice.prof', help='Where to write the cProfile stats')
+    subcommand.set_defaults(func=profile_document, calendar_context=None)
+    return parser
+
+# -------------- MAIN WORKFLOW --------------
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if 'parquet' in (getattr(args, 'report_format', None) or []):
+        # Checked before the Gmail scan in full-run, not after it
+        from generate_reisekosten_excel import check_export_formats
+        try:
+            check_export_formats(args.report_format)
+        except ValueError as e:
+            parser.error(str(e))
+    METRICS.configure(json_log_path=args.metrics_json)
+    record_path, replay_path = getattr(args, 'record', None), getattr(args, 'replay', None)
+    try:
+        cassette = use_cassette(record_path or replay_path, RECORD if record_path else REPLAY)
+    except FileNotFoundError as e:
+        parser.error(str(e))
+    if cassette:
+        print(f"[i] Cassette {cassette.mode} mode: {cassette.path}")
 
     global CALENDAR_CONTEXT
     if args.calendar_context:
@@ -490,76 +615,14 @@ def main():
     os.makedirs(DOWNLOAD_DIR, exist_ok=True)
     os.makedirs(SORTED_DIR, exist_ok=True)
 
-    if args.scan_gmail:
-        service = gmail_authenticate()
-        search_query = build_search_query(KEYWORDS, TIMEFRAME, START_DATE)
-        print(f"[i] Gmail search query: {search_query}")
-        messages = search_messages(service, search_query)
-        print(f"[i] Found {len(messages)} matching emails.")
-
-        for msg in messages:
-            if msg['id'] in reviewed_ids:
-                print(f"[→] Skipping already reviewed email ID: {msg['id']}")
-                continue
-            full_message = service.users().messages().get(userId='me', id=msg['id'], format='full').execute()
-            subject = "No Subject"
-            for header in full_message['payload'].get('headers', []):
-                if header['name'] == 'Subject':
-                    subject = header['value']
-                    break
-            sender = ""
-            for header in full_message['payload'].get('headers', []):
-                if header['name'].lower() == 'from':
-                    sender = header['value']
-                    break
-            if any(blacklisted in sender for blacklisted in BLACKLISTED_SENDERS):
-                print(f"[→] Skipping blacklisted sender: {sender}")
-                continue
-            print(f"\n--- Processing email: {subject} ---")
-
-            for file_path in download_attachments(service, msg['id'], DOWNLOAD_DIR):
-                text = extract_text_from_pdf(file_path)
-                print(f"[i] Categorizing file: {file_path}")
-                print(f"[i] Extracted text preview: {text[:100]}...")
-                category = categorize_invoice(text)
-                sort_file_to_category(file_path, category, text, args.rename_by_date, calendar_context=CALENDAR_CONTEXT)
-
-            links = extract_invoice_links_with_ollama(service, msg['id'])
-            if links:
-                def process_link(link, subject, message_id):
-                    file_path_from_link = download_pdf_from_url(link, DOWNLOAD_DIR, subject, message_id)
-                    if file_path_from_link:
-                        text = extract_text_from_pdf(file_path_from_link)
-                        print(f"[i] Categorizing file: {file_path_from_link}")
-                        print(f"[i] Extracted text preview: {text[:100]}...")
-                        category = categorize_invoice(text)
-                        sort_file_to_category(file_path_from_link, category, text, args.rename_by_date, calendar_context=CALENDAR_CONTEXT)
-                        return True
-                    return False
-
-                success = False
-                with ThreadPoolExecutor(max_workers=4) as executor:
-                    futures = [executor.submit(process_link, link, subject, msg['id']) for link in links]
-                    for future in as_completed(futures):
-                        if future.result():
-                            success = True
-                if not success:
-                    print("[!] All extracted links failed to download.")
-
-    if args.generate_travel_report:
-        from generate_reisekosten_excel import generate_travel_report
-        generate_travel_report(
-            args.generate_travel_report,
-            SORTED_DIR,
-            CALENDAR_CONTEXT,
-            language=args.lang,
-            use_cache=args.use_cache,
-            use_parallel=args.parallel
-        )
-        return
-
-    if args.process_local:
-        process_dropped_invoices(rename_by_date=args.rename_by_date, calendar_context=CALENDAR_CONTEXT)
+    try:
+        args.func(args)
+    finally:
+        METRICS.log_counters()
+        METRICS.print_summary()
+        if args.metrics_prom:
+            METRICS.write_prometheus(args.metrics_prom)
+            print(f"[✓] Metrics written to {args.metrics_prom}")
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
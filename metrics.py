@@ -0,0 +1,136 @@
+import os
+import json
+import time
+import threading
+import functools
+from contextlib import contextmanager
+
+# Latency histogram buckets in seconds (Prometheus "le" bounds)
+BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60]
+METRIC_PREFIX = "invoice_sorter"
+
+# -------------- Registry --------------
+class Metrics:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.durations = {}  # stage -> list of seconds
+        self.counters = {}   # name -> number
+        self._json_log = None
+
+    def configure(self, json_log_path=None):
+        with self._lock:
+            if self._json_log:
+                self._json_log.close()
+            self._json_log = open(json_log_path, "a", encoding="utf-8") if json_log_path else None
+
+    def reset(self):
+        with self._lock:
+            self.durations.clear()
+            self.counters.clear()
+
+    def _log(self, event):
+        # Called with the lock held
+        if self._json_log:
+            self._json_log.write(json.dumps({"ts": round(time.time(), 3), **event}) + "\n")
+            self._json_log.flush()
+
+    def observe(self, stage, seconds, **fields):
+        with self._lock:
+            self.durations.setdefault(stage, []).append(seconds)
+            self._log({"event": "stage", "stage": stage, "seconds": round(seconds, 6), **fields})
+
+    def count(self, name, value=1, **fields):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+            if fields:
+                self._log({"event": "count", "name": name, "value": value, **fields})
+
+    def log_counters(self):
+        # Counters are only written once per run; per-increment lines would flood the log
+        with self._lock:
+            if self.counters:
+                self._log({"event": "counters", "counters": dict(self.counters)})
+
+    @contextmanager
+    def timer(self, stage, **fields):
+        start = time.perf_counter()
+        status = "ok"
+        try:
+            yield
+        except Exception:
+            status = "error"
+            raise
+        finally:
+            self.observe(stage, time.perf_counter() - start, status=status, **fields)
+
+    def timed(self, stage):
+        def decorator(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.timer(stage):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    # -------------- Reporting --------------
+    def summary_table(self):
+        with self._lock:
+            durations = {stage: sorted(values) for stage, values in self.durations.items()}
+            counters = dict(self.counters)
+        lines = [f"{'stage':<22} {'count':>6} {'total s':>9} {'mean ms':>9} {'p50 ms':>9} {'p95 ms':>9} {'max ms':>9}"]
+        for stage, values in sorted(durations.items(), key=lambda item: -sum(item[1])):
+            total = sum(values)
+            p50 = values[len(values) // 2]
+            p95 = values[min(len(values) - 1, int(len(values) * 0.95))]
+            lines.append(
+                f"{stage:<22} {len(values):>6} {total:>9.2f} {total / len(values) * 1000:>9.1f} "
+                f"{p50 * 1000:>9.1f} {p95 * 1000:>9.1f} {values[-1] * 1000:>9.1f}"
+            )
+        for name, value in sorted(counters.items()):
+            lines.append(f"{name:<22} {value:>6}")
+        return "\n".join(lines)
+
+    def print_summary(self):
+        if self.durations or self.counters:
+            print("\n[i] Run metrics:")
+            print(self.summary_table())
+
+    def prometheus_text(self):
+        with self._lock:
+            durations = {stage: list(values) for stage, values in self.durations.items()}
+            counters = dict(self.counters)
+        name = f"{METRIC_PREFIX}_stage_duration_seconds"
+        lines = [f"# HELP {name} Time spent per pipeline stage.", f"# TYPE {name} histogram"]
+        for stage, values in sorted(durations.items()):
+            for bound in BUCKETS:
+                lines.append(f'{name}_bucket{{stage="{stage}",le="{bound}"}} {sum(1 for v in values if v <= bound)}')
+            lines.append(f'{name}_bucket{{stage="{stage}",le="+Inf"}} {len(values)}')
+            lines.append(f'{name}_sum{{stage="{stage}"}} {sum(values):.6f}')
+            lines.append(f'{name}_count{{stage="{stage}"}} {len(values)}')
+        for counter, value in sorted(counters.items()):
+            lines.append(f"# TYPE {METRIC_PREFIX}_{counter}_total counter")
+            lines.append(f"{METRIC_PREFIX}_{counter}_total {value}")
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, path):
+        # Write then rename so the node_exporter textfile collector never reads a partial file
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(self.prometheus_text())
+        os.replace(tmp_path, path)
+
+METRICS = Metrics()
+timer = METRICS.timer
+timed = METRICS.timed
+count = METRICS.count
+
+# -------------- Single-Document Profiling --------------
+def profile_call(output_path, func, *args, **kwargs):
+    import cProfile
+    import pstats
+    profiler = cProfile.Profile()
+    result = profiler.runcall(func, *args, **kwargs)
+    profiler.dump_stats(output_path)
+    pstats.Stats(profiler).sort_stats("cumulative").print_stats(20)
+    print(f"[✓] Profile written to {output_path}")
+    return result
@@ -0,0 +1,74 @@
+import re
+from invoice_extraction import AMOUNT_PATTERN, DATE_PATTERN, AMOUNT_LABELS, DATE_LABELS
+
+PROMPT_TOKEN_BUDGET = 300  # the old 2000-character slice was ~500 tokens
+HEADER_LINES = 8  # vendor name, address and invoice number usually sit at the top
+
+KEYWORD_PATTERN = re.compile(
+    r'rechnung|invoice|beleg|quittung|receipt|ticket|fahrkarte|hotel|übernachtung|flug|flight|taxi|parken|parking|'
+    r'bahn|restaurant|bewirtung|versicherung|insurance|abo|subscription|artikel|menge|qty|anzahl|pos\.',
+    re.IGNORECASE,
+)
+BOILERPLATE_PATTERN = re.compile(
+    r'agb|geschäftsbedingungen|terms and conditions|terms of service|datenschutz|privacy|widerruf|haftung|liability|'
+    r'gerichtsstand|jurisdiction|handelsregister|registergericht|geschäftsführer|managing director|ust-idnr|steuernummer|'
+    r'iban|bic|swift|bankverbindung|seite \d+|page \d+',
+    re.IGNORECASE,
+)
+
+def estimate_tokens(text):
+    # Rough BPE estimate (~4 characters per token) so no tokenizer dependency is needed
+    return (len(text) + 3) // 4
+
+def _line_score(index, line):
+    score = 0
+    if index < HEADER_LINES:
+        score += 3
+    if AMOUNT_PATTERN.search(line):
+        score += 3
+    if DATE_PATTERN.search(line):
+        score += 2
+    # Weighted by label rank so grand totals and invoice dates outrank line items under tight budgets
+    score += max((weight for pattern, weight in AMOUNT_LABELS + DATE_LABELS if weight > 0 and pattern.search(line)), default=0)
+    if KEYWORD_PATTERN.search(line):
+        score += 2
+    if BOILERPLATE_PATTERN.search(line):
+        score -= 4
+    if len(line) > 200:
+        score -= 2  # long prose paragraphs are rarely line items or totals
+    return score
+
+def compact_invoice_text(text, token_budget=PROMPT_TOKEN_BUDGET):
+    if not text or estimate_tokens(text) <= token_budget:
+        return text
+
+    lines = []
+    seen = set()
+    for line in text.splitlines():
+        line = " ".join(line.split())
+        if not line or line.lower() in seen:
+            continue
+        seen.add(line.lower())
+        lines.append(line)
+
+    ranked = sorted(range(len(lines)), key=lambda i: (-_line_score(i, lines[i]), i))
+    selected = {}
+    used = 0
+    for i in ranked:
+        line = lines[i]
+        cost = estimate_tokens(line) + 1
+        if cost > token_budget:
+            # Paragraphs or whole pages extracted as a single line would never fit; keep their start
+            line = line[:(token_budget - used - 1) * 4]
+            if not line:
+                continue
+            cost = estimate_tokens(line) + 1
+        if used + cost > token_budget:
+            continue
+        selected[i] = line
+        used += cost
+
+    if not selected:
+        return text[:token_budget * 4]
+    # Keep the original reading order so totals stay next to their labels
+    return "\n".join(selected[i] for i in sorted(selected))
@@ -0,0 +1,47 @@
+import argparse
+import statistics
+import subprocess
+import sys
+from pathlib import Path
+
+# Cold-start regression check: `import main` must stay cheap and must not pull in the heavy
+# dependencies, which are only imported by the subcommands that need them.
+REPO_DIR = Path(__file__).resolve().parent.parent
+HEAVY_MODULES = ["fitz", "pymupdf", "ollama", "openai", "pandas", "openpyxl", "bs4", "requests",
+                 "googleapiclient", "google_auth_oauthlib", "watchdog", "ics"]
+CHECKED_MODULES = ["main", "generate_reisekosten_excel", "invoice_extraction", "prompt_compaction", "file_placement"]
+
+def import_profile(module):
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=REPO_DIR, capture_output=True, text=True, check=True
+    )
+    cumulative_us = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line.split("|")
+        if cumulative.strip().isdigit():
+            cumulative_us[name.strip()] = int(cumulative)
+    return cumulative_us
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--budget-ms', type=float, default=150.0, help='Maximum median cumulative import time per module')
+    parser.add_argument('--runs', type=int, default=5, help='Number of cold imports to take the median of')
+    args = parser.parse_args()
+
+    failed = False
+    for module in CHECKED_MODULES:
+        profiles = [import_profile(module) for _ in range(args.runs)]
+        median_ms = statistics.median(profile[module] for profile in profiles) / 1000
+        heavy = sorted({name for name in profiles[0] for heavy in HEAVY_MODULES if name == heavy or name.startswith(heavy + ".")})
+        status = "✓" if median_ms <= args.budget_ms and not heavy else "!"
+        print(f"[{status}] import {module}: {median_ms:.1f} ms (budget {args.budget_ms:.0f} ms)")
+        if heavy:
+            print(f"    heavy modules imported at load time: {', '.join(heavy)}")
+        failed = failed or status == "!"
+    sys.exit(1 if failed else 0)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,154 @@
+import os
+import sys
+import time
+import types
+import random
+import shutil
+import hashlib
+import argparse
+import tempfile
+import importlib.util
+from pathlib import Path
+
+# Record -> replay check: records a scan-gmail run against the benchmark fakes, then replays the
+# cassette offline (fresh directory, and the recording directory with Invoices/ moved away) and
+# compares the sorted trees. Exits non-zero on any difference.
+REPO_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(REPO_DIR))
+
+_spec = importlib.util.spec_from_file_location("run_benchmark", REPO_DIR / "scripts" / "run-benchmark.py")
+bench = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(bench)
+
+def sorted_tree(root):
+    tree = {}
+    for dirpath, _, filenames in os.walk(root):
+        for filename in filenames:
+            path = os.path.join(dirpath, filename)
+            with open(path, "rb") as f:
+                tree[os.path.relpath(path, root)] = hashlib.sha256(f.read()).hexdigest()
+    return tree
+
+VIOLATIONS = []  # main.py catches most download errors, so offline() also records its calls
+
+def offline(name):
+    def call(*args, **kwargs):
+        VIOLATIONS.append(name)
+        raise AssertionError(f"replay must not call {name}")
+    return call
+
+def run(sorter, argv):
+    import file_placement
+    # Each CLI run is a fresh process; don't carry name reservations over between runs
+    file_placement.ALLOCATOR = file_placement.NameAllocator()
+    sorter.main(argv)
+
+def compare(name, expected, actual):
+    if expected == actual:
+        print(f"[✓] {name}: {len(actual)} files match the recording")
+        return True
+    print(f"[!] {name}: sorted tree differs from the recording")
+    for path in sorted(set(expected) | set(actual)):
+        if expected.get(path) != actual.get(path):
+            print(f"    {path}: recorded={'yes' if path in expected else 'no'} replayed={'yes' if path in actual else 'no'}")
+    return False
+
+def add_twin_links(messages, pdfs):
+    # Two links in one email with the same URL basename and the same invoice date, so the
+    # _1/_2 names only stay stable if placement doesn't depend on which download finishes first
+    twins = [bench.make_invoice_pdf(random.Random(7), index) for index in (90001, 90002)]
+    links = ""
+    for number, data in enumerate(twins, 1):
+        path = f"/invoice/download?id={number}"
+        pdfs[path] = data
+        links += f'<a href="{{base_url}}{path}">Rechnung {number} herunterladen (PDF)</a>'
+    messages["msg99999"] = {"id": "msg99999", "payload": {
+        "headers": [{"name": "Subject", "value": "Ihre Rechnungen 99999"},
+                    {"name": "From", "value": "billing@vendor.example"}],
+        "parts": [{"filename": "", "mimeType": "text/html", "body": {"data": f"<p>Zwei Rechnungen.</p>{links}"}}],
+    }}
+
+def check(sorter, workdir, messages, attachments, pdfs, flags):
+    # One link behind a login page, so the browser-cookie retry is part of the recording
+    served = dict(pdfs)
+    served[sorted(pdfs)[0]] = b"<html>Please log in</html>"
+    server, base_url = bench.start_pdf_server(served)
+    bench.install_mock_llm(0)
+    # Jitter the mock LLM so parallel work finishes in a different order on every run
+    chat = sys.modules["ollama"].chat
+    sys.modules["ollama"] = types.SimpleNamespace(
+        chat=lambda *args, **kwargs: time.sleep(random.random() * 0.02) or chat(*args, **kwargs))
+    sys.modules["browser_cookie3"] = types.SimpleNamespace(load=lambda: None)
+    service = bench.FakeGmailService(messages, attachments, base_url)
+    sorter.gmail_authenticate = lambda: service
+
+    record_dir = os.path.join(workdir, "record")
+    fresh_dir = os.path.join(workdir, "fresh")
+    os.makedirs(record_dir, exist_ok=True)
+    os.makedirs(fresh_dir, exist_ok=True)
+    cassette_path = os.path.join(workdir, "run.cassette")
+
+    # An email reviewed before the recording must be skipped in every replay as well
+    os.chdir(record_dir)
+    with open("review_queue.csv", "w", newline="", encoding="utf-8") as f:
+        f.write("Subject,URL,Reason,Gmail Link\n")
+        f.write("Ihre Rechnung 00001,N/A,Reviewed,https://mail.google.com/mail/u/0/#inbox/msg00001\n")
+    run(sorter, ["scan-gmail", *flags, "--record", cassette_path])
+    recorded = sorted_tree(sorter.SORTED_DIR)
+    with open("review_queue.csv", "rb") as f:
+        queue = f.read()
+    server.shutdown()
+    server.server_close()
+
+    sorter.gmail_authenticate = offline("gmail_authenticate")
+    sys.modules["ollama"] = types.SimpleNamespace(chat=offline("ollama.chat"))
+    sys.modules["browser_cookie3"] = types.SimpleNamespace(load=offline("browser_cookie3.load"))
+
+    label = " ".join(flags) or "default flags"
+    ok = True
+    os.chdir(fresh_dir)
+    run(sorter, ["scan-gmail", *flags, "--replay", cassette_path])
+    ok &= compare(f"replay in a fresh directory ({label})", recorded, sorted_tree(sorter.SORTED_DIR))
+    if os.path.exists("review_queue.csv"):
+        print("[!] replay in a fresh directory wrote review_queue.csv")
+        ok = False
+
+    os.chdir(record_dir)
+    shutil.move(sorter.SORTED_DIR, f"{sorter.SORTED_DIR}.recorded")
+    run(sorter, ["scan-gmail", *flags, "--replay", cassette_path])
+    ok &= compare(f"replay in the recording directory ({label})", recorded, sorted_tree(sorter.SORTED_DIR))
+    with open("review_queue.csv", "rb") as f:
+        if f.read() != queue:
+            print("[!] replay changed review_queue.csv")
+            ok = False
+    return ok
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--emails', type=int, default=20, help='Number of synthetic emails')
+    parser.add_argument('--seed', type=int, default=42, help='Seed for the synthetic corpus')
+    parser.add_argument('--workdir', help='Directory to run in (default: a fresh temp dir)')
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    messages, attachments, pdfs, _ = bench.build_corpus(rng, args.emails, 0, 0.5)
+    add_twin_links(messages, pdfs)
+
+    workdir = os.path.abspath(args.workdir or tempfile.mkdtemp(prefix="invoice-replay-"))
+    print(f"[i] Working directory: {workdir}")
+
+    import main as sorter
+    ok = True
+    # Without renaming the twins collide on their URL basename, with --rename-by-date on their date
+    for name, flags in [("basename", []), ("by-date", ["--rename-by-date"])]:
+        ok &= check(sorter, os.path.join(workdir, name), messages, attachments, pdfs, flags)
+
+    if VIOLATIONS:
+        print(f"[!] Replay went online: {', '.join(sorted(set(VIOLATIONS)))}")
+        ok = False
+
+    print("[✓] Replay matches the recording" if ok else "[!] Replay does not match the recording")
+    sys.exit(0 if ok else 1)
+
+if __name__ == '__main__':
+    main()
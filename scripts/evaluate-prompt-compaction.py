@@ -0,0 +1,39 @@
+import csv
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from main import extract_text_from_pdf, categorize_invoice
+from prompt_compaction import PROMPT_TOKEN_BUDGET, compact_invoice_text, estimate_tokens
+
+# Labelled sample set: CSV with columns "path" and "category"
+SAMPLES_CSV = sys.argv[1] if len(sys.argv) > 1 else "labelled_invoices.csv"
+
+with open(SAMPLES_CSV, newline="", encoding="utf-8") as file:
+    samples = [(row["path"], row["category"]) for row in csv.DictReader(file)]
+
+# Compare the previous truncation against compaction at a few token budgets
+BUDGETS = sorted({150, 250, 350, 500, PROMPT_TOKEN_BUDGET})
+strategies = {"truncate": lambda text: text[:2000]}  # previous behaviour
+for budget in BUDGETS:
+    strategies[f"compact-{budget}"] = lambda text, budget=budget: compact_invoice_text(text, budget)
+results = {name: {"tokens": 0, "seconds": 0.0, "correct": 0} for name in strategies}
+
+for path, expected in samples:
+    text = extract_text_from_pdf(path)
+    for name, prepare in strategies.items():
+        prompt_text = prepare(text)
+        start = time.perf_counter()
+        # The text is already prepared, so categorize_invoice must not compact it again
+        category = categorize_invoice(prompt_text, compact=False)
+        results[name]["seconds"] += time.perf_counter() - start
+        results[name]["tokens"] += estimate_tokens(prompt_text)
+        results[name]["correct"] += category.strip().lower() == expected.strip().lower()
+    print(f"[•] {Path(path).name}: expected {expected}")
+
+count = max(len(samples), 1)
+print(f"\n{'strategy':<12} {'avg tokens':>10} {'avg latency':>12} {'accuracy':>9}")
+for name, result in results.items():
+    print(f"{name:<12} {result['tokens'] / count:>10.0f} {result['seconds'] / count:>11.2f}s {result['correct'] / count:>9.1%}")
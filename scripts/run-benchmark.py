@@ -0,0 +1,239 @@
+import os
+import sys
+import json
+import time
+import types
+import base64
+import random
+import argparse
+import tempfile
+import threading
+from pathlib import Path
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Benchmark harness: runs the Gmail scan, local processing and travel report against an in-process
+# fake Gmail service, a local HTTP server and a deterministic mock LLM, so throughput can be
+# compared between commits without a Gmail account or a running Ollama.
+REPO_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(REPO_DIR))
+os.environ.setdefault("NO_PROXY", "127.0.0.1,localhost")
+os.environ.pop("USE_OPENAI", None)
+
+YEAR = 2024
+VENDORS = {
+    "Travel": [("Deutsche Bahn", "Bahn Fahrkarte Berlin - München", "Transport"),
+               ("Hotel Adlon", "Hotel Übernachtung Doppelzimmer", "Hotel"),
+               ("City Parking", "Parken Parkhaus Zentrum", "Parking")],
+    "Food": [("Restaurant Lindenhof", "Restaurant Mittagessen Bewirtung", "Meal")],
+    "Work Equipment": [("Office World", "Monitor 27 Zoll und Tastatur", "Fee")],
+}
+BOILERPLATE = ("Es gelten unsere Allgemeinen Geschäftsbedingungen. Hinweise zum Datenschutz finden Sie auf "
+               "unserer Website. Gerichtsstand ist Berlin. ") * 6
+
+# -------------- Synthetic Corpus --------------
+def make_invoice_pdf(rng, index):
+    import fitz
+    category = rng.choice(["Travel", "Travel", "Food", "Work Equipment"])
+    vendor, item, _ = rng.choice(VENDORS[category])
+    day, month = rng.randint(1, 28), rng.randint(1, 12)
+    amount = rng.randint(500, 50000) / 100
+    doc = fitz.open()
+    page = doc.new_page()
+    lines = [vendor, "Musterstraße 1, 10115 Berlin", f"Rechnung Nr. {index:05d}",
+             f"Rechnungsdatum: {day:02d}.{month:02d}.{YEAR}", f"{item}   {amount:.2f} €".replace(".", ","),
+             f"Gesamtbetrag: {amount:.2f} EUR".replace(".", ",")]
+    page.insert_text((50, 60), "\n".join(lines), fontsize=10)
+    # Vary document size with terms-and-conditions pages
+    for _ in range(rng.randint(0, 4)):
+        doc.new_page().insert_textbox(fitz.Rect(50, 50, 550, 800), BOILERPLATE * 4, fontsize=8)
+    return doc.tobytes()
+
+def build_corpus(rng, emails, local_pdfs, link_ratio):
+    pdfs = {}          # url path -> bytes (served by the HTTP server)
+    attachments = {}   # attachment id -> bytes
+    messages = {}
+    counter = 0
+    for i in range(emails):
+        message_id = f"msg{i:05d}"
+        parts = []
+        html = "<p>Vielen Dank für Ihren Einkauf.</p>"
+        if rng.random() < link_ratio:
+            counter += 1
+            path = f"/invoice/{counter:05d}.pdf"
+            pdfs[path] = make_invoice_pdf(rng, counter)
+            html += f'<a href="{{base_url}}{path}">Rechnung herunterladen (PDF)</a>'
+        else:
+            counter += 1
+            attachment_id = f"att{counter:05d}"
+            attachments[attachment_id] = make_invoice_pdf(rng, counter)
+            parts.append({"filename": f"Rechnung_{counter:05d}.pdf", "mimeType": "application/pdf",
+                          "body": {"attachmentId": attachment_id, "size": len(attachments[attachment_id])}})
+        html += '<a href="https://example.com/impressum">Impressum</a>'
+        parts.insert(0, {"filename": "", "mimeType": "text/html", "body": {"data": html}})
+        messages[message_id] = {"id": message_id, "payload": {
+            "headers": [{"name": "Subject", "value": f"Ihre Rechnung {i:05d}"},
+                        {"name": "From", "value": "billing@vendor.example"}],
+            "parts": parts,
+        }}
+    local = [make_invoice_pdf(rng, counter + i + 1) for i in range(local_pdfs)]
+    return messages, attachments, pdfs, local
+
+# -------------- Fake Gmail Service --------------
+class _Call:
+    def __init__(self, result):
+        self._result = result
+
+    def execute(self):
+        return self._result
+
+class FakeGmailService:
+    def __init__(self, messages, attachments, base_url, page_size=100):
+        self._messages = messages
+        self._attachments = attachments
+        self._base_url = base_url
+        self._page_size = page_size
+
+    def users(self):
+        return self
+
+    def messages(self):
+        return self
+
+    def attachments(self):
+        return _FakeAttachments(self._attachments)
+
+    def list(self, userId, q, pageToken=None):
+        ids = sorted(self._messages)
+        start = int(pageToken or 0)
+        page = ids[start:start + self._page_size]
+        response = {"messages": [{"id": message_id} for message_id in page]}
+        if start + self._page_size < len(ids):
+            response["nextPageToken"] = str(start + self._page_size)
+        return _Call(response)
+
+    def get(self, userId, id, format=None):
+        message = json.loads(json.dumps(self._messages[id]))
+        for part in message["payload"]["parts"]:
+            if "data" in part["body"]:
+                html = part["body"]["data"].replace("{base_url}", self._base_url)
+                part["body"]["data"] = base64.urlsafe_b64encode(html.encode()).decode()
+        return _Call(message)
+
+class _FakeAttachments:
+    def __init__(self, attachments):
+        self._attachments = attachments
+
+    def get(self, userId, messageId, id):
+        return _Call({"data": base64.urlsafe_b64encode(self._attachments[id]).decode()})
+
+# -------------- Local HTTP Server --------------
+def start_pdf_server(pdfs):
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            body = pdfs.get(self.path)
+            self.send_response(200 if body else 404)
+            content_type = "text/plain" if not body else "application/pdf" if body.startswith(b"%PDF") else "text/html"
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body or b"")))
+            self.end_headers()
+            self.wfile.write(body or b"")
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+# -------------- Mock LLM --------------
+def install_mock_llm(latency):
+    def section(prompt, start, end=None):
+        text = prompt.split(start, 1)[-1]
+        return text.split(end, 1)[0] if end else text
+
+    def chat(model, messages, options=None, **kwargs):
+        time.sleep(latency)
+        prompt = messages[-1]["content"]
+        if "PDF Links:" in prompt:
+            links = [line.split("→")[-1].strip() for line in section(prompt, "Links:", "PDF Links:").splitlines()]
+            content = "\n".join(link for link in links if "/invoice/" in link)
+        elif "Category:" in prompt:
+            invoice = section(prompt, "Invoice:", "Category:")
+            content = next((category for category, vendors in VENDORS.items()
+                            if any(vendor in invoice for vendor, _, _ in vendors)), "Other")
+        elif "Invoice content:" in prompt:
+            invoice = section(prompt, "Invoice content:")
+            kind = next((kind for vendors in VENDORS.values() for vendor, _, kind in vendors if vendor in invoice), "Fee")
+            content = json.dumps({"anlass": "Kundentermin", "distance_km": 120, "type": kind})
+        else:
+            content = ""
+        return {"message": {"content": content}}
+
+    sys.modules["ollama"] = types.SimpleNamespace(chat=chat)
+
+# -------------- Runner --------------
+def run_phase(name, documents, func, results):
+    from metrics import METRICS
+    METRICS.reset()
+    start = time.perf_counter()
+    func()
+    seconds = time.perf_counter() - start
+    stages = {stage: round(sum(values), 4) for stage, values in METRICS.durations.items()}
+    results[name] = {"documents": documents, "seconds": round(seconds, 3),
+                     "docs_per_sec": round(documents / seconds, 2) if seconds else None, "stages": stages}
+    if name != "gmail":  # main() already prints its own summary
+        METRICS.print_summary()
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--emails', type=int, default=50, help='Number of synthetic emails')
+    parser.add_argument('--local-pdfs', type=int, default=50, help='Number of PDFs dropped into temp_invoices/')
+    parser.add_argument('--link-ratio', type=float, default=0.5, help='Share of emails with an invoice link instead of an attachment')
+    parser.add_argument('--llm-latency-ms', type=float, default=20, help='Simulated latency per LLM call')
+    parser.add_argument('--seed', type=int, default=42, help='Seed for the synthetic corpus')
+    parser.add_argument('--workdir', help='Directory to run in (default: a fresh temp dir)')
+    parser.add_argument('--json-output', help='Write results as JSON to this file for comparing runs')
+    args = parser.parse_args()
+
+    if args.json_output:
+        args.json_output = os.path.abspath(args.json_output)
+    rng = random.Random(args.seed)
+    print("[i] Generating synthetic corpus...")
+    messages, attachments, pdfs, local = build_corpus(rng, args.emails, args.local_pdfs, args.link_ratio)
+    server, base_url = start_pdf_server(pdfs)
+    install_mock_llm(args.llm_latency_ms / 1000)
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix="invoice-bench-")
+    os.makedirs(workdir, exist_ok=True)
+    os.chdir(workdir)
+    print(f"[i] Working directory: {workdir}")
+
+    import main as sorter
+    from generate_reisekosten_excel import generate_travel_report
+    service = FakeGmailService(messages, attachments, base_url)
+    sorter.gmail_authenticate = lambda: service
+
+    results = {}
+    run_phase("gmail", len(messages), lambda: sorter.main(["scan-gmail"]), results)
+
+    os.makedirs(sorter.DOWNLOAD_DIR, exist_ok=True)
+    for i, data in enumerate(local):
+        with open(os.path.join(sorter.DOWNLOAD_DIR, f"local_{i:05d}.pdf"), "wb") as f:
+            f.write(data)
+    run_phase("local", len(local), lambda: sorter.process_dropped_invoices(watch=False), results)
+
+    report_documents = sum(len(os.listdir(os.path.join(sorter.SORTED_DIR, category)))
+                           for category in ["Travel", "Food"] if os.path.isdir(os.path.join(sorter.SORTED_DIR, category)))
+    run_phase("report", report_documents, lambda: generate_travel_report(YEAR, sorter.SORTED_DIR, {}), results)
+    server.shutdown()
+
+    print(f"\n{'phase':<8} {'documents':>9} {'seconds':>8} {'docs/sec':>9}")
+    for name, result in results.items():
+        print(f"{name:<8} {result['documents']:>9} {result['seconds']:>8.2f} {result['docs_per_sec'] or 0:>9.2f}")
+    if args.json_output:
+        with open(args.json_output, "w", encoding="utf-8") as f:
+            json.dump({"args": vars(args), "results": results}, f, indent=2)
+        print(f"[✓] Results written to {args.json_output}")
+
+if __name__ == '__main__':
+    main()